@@ -1,14 +1,29 @@
 #!/usr/bin/env python
 # Utility to handle with software versions
 # Author: xiaming.chen@transwarp.io
-import copy
+import functools
 import re
+import sys
+
+try:
+    import numpy as np
+except ImportError:  # Only the batch helpers of FlexVersion need numpy
+    np = None
 
 __all__ = ['FlexVersion', 'VersionMeta', 'VersionDelta']
 
+# Matched against the whole string, separators are kept out of the groups.
+# DOTALL lets the suffix reach the end of any input, so a failed prefix
+# split is never retried over the rest of the string (no quadratic cases).
+# The raw suffix is split into its label and version within the same match.
+# ASCII keeps \d to 0-9, other Unicode digits are not version numbers here.
+_V_RE = re.compile(r"(?:(?P<prefix>.*)-)?(?P<major>\d+)\.(?P<minor>\d+)"
+                   r"(?:\.(?P<maintenance>\d+))?(?:\.(?P<build>\d+))?"
+                   r"(?:-(?P<suffix_raw>(?P<suffix>\D*)(?P<suffix_version>\d+)?.*))?",
+                   re.DOTALL | re.ASCII)
 
-def _cmp(x, y):
-    return 0 if x == y else 1 if x > y else -1
+# Separators and blanks trimmed off the textual fields.
+_TRIM_CHARS = ' \r\n-.'
 
 
 def _cmperror(x, y):
@@ -16,31 +31,83 @@ def _cmperror(x, y):
         type(x).__name__, type(y).__name__))
 
 
-def _verdiff(v1, v2, none_as=None):
-    v1 = none_as if v1 is None else v1
-    v2 = none_as if v2 is None else v2
-    return None if None in (v1, v2) else v1 - v2
+def _match_version(version_str):
+    """
+    Split a version string into prefix, major, minor, maintenance, build,
+    raw suffix, suffix and suffix version with a single _V_RE match.
+    Surrounding whitespace is ignored.
+    """
+    if not isinstance(version_str, str):
+        raise TypeError('Expected a version string, got {}'.format(
+            type(version_str).__name__))
+    version_str = version_str.strip()
+    matched = _V_RE.fullmatch(version_str)
+    if matched is None:
+        raise ValueError(
+            'Could not parse the given version: {}'.format(version_str))
+
+    prefix, major, minor, maintenance, build, suffix_raw, suffix, suffix_version = \
+        matched.groups()
+    if prefix is not None:
+        prefix = prefix.strip(_TRIM_CHARS)
+    if suffix_raw is not None:
+        suffix_raw = suffix_raw.strip(_TRIM_CHARS)
+    if suffix_raw:
+        suffix = suffix.strip(_TRIM_CHARS)
+        if suffix_version is not None:
+            suffix_version = int(suffix_version)
+    else:
+        suffix = suffix_version = None
+
+    return (
+        prefix,
+        int(major),
+        int(minor),
+        int(maintenance) if maintenance is not None else None,
+        int(build) if build is not None else None,
+        suffix_raw,
+        suffix,
+        suffix_version
+    )
+
+
+def _as_meta(version):
+    """
+    Return version itself if already a VersionMeta, else its cached parse.
+    """
+    return version if isinstance(version, VersionMeta) else _parse_cached(version)
 
 
-def _veradd(v1, v2, none_as=None):
-    v1 = none_as if v1 is None else v1
-    v2 = none_as if v2 is None else v2
-    return None if None in (v1, v2) else v1 + v2
+# Batch keys are int64, with -1 standing for a missing number.
+_INT64_MAX = 2 ** 63 - 1
+_MISSING_KEY = (-1, -1, -1, -1)
 
 
-def _verrev(v1, none_as=None):
-    v1 = none_as if v1 is None else v1
-    return None if v1 is None else -v1
+def _int64_key(key):
+    """
+    The numeric key as an int64 row for the numpy helpers, or None if some
+    number does not fit into int64.
+    """
+    if any(n is not None and n > _INT64_MAX for n in key):
+        return None
+    return [-1 if n is None else n for n in key]
 
 
-def _verabs(v1, none_as=None):
-    v1 = none_as if v1 is None else v1
-    return None if v1 is None else v1 if v1 > 0 else -v1
+def _numeric_key(major, minor, maintenance, build):
+    """
+    Pack the numeric fields into a comparison key, along with the positions
+    of missing fields: keys of the same shape compare as plain tuples.
+    """
+    return ((major, minor, maintenance, build),
+            (major is None, minor is None, maintenance is None, build is None))
 
 
-def _vermul(v1, integer, none_as=None):
-    v1 = none_as if v1 is None else v1
-    return None if v1 is None else v1 + integer
+@functools.lru_cache(maxsize=1024)
+def _parse_cached(version_str):
+    """
+    Parse a version string once and share the VersionMeta among callers.
+    """
+    return VersionMeta(version_str)
 
 
 class FlexVersion(object):
@@ -48,37 +115,51 @@ class FlexVersion(object):
     Main version utility functions.
     """
     ordered_suffix = None
+    _suffix_rank_src = None
+    _suffix_rank = None
+
+    @classmethod
+    def _suffix_ranks(cls):
+        """
+        Map each suffix in ordered_suffix to its position.
+        The table is rebuilt whenever ordered_suffix differs from the copy
+        it was built from, so in-place edits of the list are picked up too.
+        """
+        ordered = cls.ordered_suffix
+        if ordered != cls._suffix_rank_src:
+            ranks = dict()
+            for i, suffix in enumerate(ordered):
+                ranks.setdefault(suffix, i)
+            cls._suffix_rank = ranks
+            cls._suffix_rank_src = list(ordered)
+        return cls._suffix_rank
 
     @classmethod
     def parse(cls, version_str):
         """Convert a version string to VersionMeta.
         """
-        return VersionMeta(version_str)
+        return _parse_cached(version_str)
 
     @classmethod
     def parse_version(cls, version_str):
         """Convert a version string to VersionMeta.
         """
-        return VersionMeta(version_str)
+        return _parse_cached(version_str)
 
     @classmethod
     def shares_prefix(cls, v1, v2):
         """ Check if two versions share the same prefix
         """
-        if not isinstance(v1, VersionMeta):
-            v1 = VersionMeta(v1)
-        if not isinstance(v2, VersionMeta):
-            v2 = VersionMeta(v2)
+        v1 = _as_meta(v1)
+        v2 = _as_meta(v2)
         return v1.shares_prefix(v2)
 
     @classmethod
     def shares_suffix(cls, v1, v2):
         """ Check if two versions share the same prefix
         """
-        if not isinstance(v1, VersionMeta):
-            v1 = VersionMeta(v1)
-        if not isinstance(v2, VersionMeta):
-            v2 = VersionMeta(v2)
+        v1 = _as_meta(v1)
+        v2 = _as_meta(v2)
         return v1.shares_suffix(v2)
 
     @classmethod
@@ -87,11 +168,9 @@ class FlexVersion(object):
         Compare the level of two versions.
         @return -1, 0 or 1
         """
-        if not isinstance(v1, VersionMeta):
-            v1 = VersionMeta(v1)
-        if not isinstance(v2, VersionMeta):
-            v2 = VersionMeta(v2)
-        return v1.compares(v2, ignore_suffix)
+        v1 = _as_meta(v1)
+        v2 = _as_meta(v2)
+        return v1._compare(v2, ignore_suffix)
 
     @classmethod
     def in_range(cls, version, minv, maxv, ignore_suffix=False):
@@ -99,15 +178,118 @@ class FlexVersion(object):
         Check if a version exists in a range of (minv, maxv).
         :return True or False
         """
-        if not isinstance(version, VersionMeta):
-            version = VersionMeta(version)
-        if not isinstance(minv, VersionMeta):
-            minv = VersionMeta(minv)
-        if not isinstance(maxv, VersionMeta):
-            maxv = VersionMeta(maxv)
+        version = _as_meta(version)
+        minv = _as_meta(minv)
+        maxv = _as_meta(maxv)
 
         return version.in_range(minv, maxv, ignore_suffix)
 
+    @classmethod
+    def range_checker(cls, minv, maxv, ignore_suffix=False):
+        """
+        Build a one-argument function with the result of
+        in_range(version, minv, maxv), the bounds are parsed and compared once.
+        Handy to filter() many versions against the same range.
+        """
+        minv = _as_meta(minv)
+        maxv = _as_meta(maxv)
+        prefix = minv._prefix
+        same_prefix = prefix == maxv._prefix
+
+        # Like in_range, misordered bounds only raise for versions that
+        # share their prefix. Skipped under python -O.
+        misordered = False
+        if __debug__:
+            misordered = same_prefix and minv._compare(maxv, ignore_suffix) > 0
+
+        # Bounds of different shapes never take the tuple shortcut.
+        shape = minv._shape if minv._shape == maxv._shape else None
+        min_key, max_key = minv._key, maxv._key
+
+        def check(version):
+            version = _as_meta(version)
+            if not same_prefix or version._prefix != prefix:
+                return False
+            if misordered:
+                raise ValueError('The minv ({}) should be a lower/equal version against maxv ({}).'
+                                 .format(minv, maxv))
+
+            if version._shape == shape:
+                key = version._key
+                if key < min_key or key > max_key:
+                    return False
+                if ignore_suffix or min_key < key < max_key:
+                    return True
+
+            if version._compare(maxv, ignore_suffix) > 0:
+                return False
+            return version._compare(minv, ignore_suffix) >= 0
+
+        return check
+
+    @classmethod
+    def compare_many(cls, pivot, candidates, ignore_suffix=False):
+        """
+        Compare every candidate against the pivot version at once,
+        the i-th item equals compares(candidates[i], pivot). Requires numpy.
+        @return numpy array of -1, 0 or 1
+        """
+        if np is None:
+            raise ImportError('FlexVersion.compare_many requires numpy')
+
+        pivot = _as_meta(pivot)
+        metas = [_as_meta(c) for c in candidates]
+
+        pivot_key = _int64_key(pivot._key)
+        if pivot_key is None:
+            return np.array([m._compare(pivot, ignore_suffix) for m in metas], dtype=np.int64)
+
+        # Missing numbers are stored as -1 and, like in compares(), match anything.
+        rows = [_int64_key(m._key) for m in metas]
+        oversized = np.array([row is None for row in rows], dtype=bool)
+        keys = np.array([_MISSING_KEY if row is None else row for row in rows],
+                        dtype=np.int64).reshape(-1, 4)
+        pivot_key = np.array(pivot_key, dtype=np.int64)
+        signs = (keys > pivot_key).astype(np.int64) - (keys < pivot_key)
+        signs[(keys < 0) | (pivot_key < 0)] = 0
+        result = signs[np.arange(len(metas)), (signs != 0).argmax(axis=1)]
+
+        # Prefix mismatches, numeric ties and numbers beyond int64 are settled
+        # one by one.
+        same_prefix = np.array([m._prefix == pivot._prefix for m in metas], dtype=bool)
+        pending = ~same_prefix if ignore_suffix else ~same_prefix | (result == 0)
+        pending |= oversized
+        for i in np.flatnonzero(pending):
+            result[i] = metas[i]._compare(pivot, ignore_suffix)
+        return result
+
+    @classmethod
+    def in_range_many(cls, versions, minv, maxv, ignore_suffix=False):
+        """
+        Check a batch of versions against the range of (minv, maxv) at once,
+        the i-th item equals in_range(versions[i], minv, maxv). Requires numpy.
+        :return numpy array of True or False
+        """
+        if np is None:
+            raise ImportError('FlexVersion.in_range_many requires numpy')
+
+        minv = _as_meta(minv)
+        maxv = _as_meta(maxv)
+        metas = [_as_meta(v) for v in versions]
+
+        same_prefix = np.array([minv._prefix == m._prefix == maxv._prefix for m in metas],
+                               dtype=bool)
+        if not same_prefix.any():
+            return same_prefix
+
+        if __debug__:
+            if minv._compare(maxv, ignore_suffix) > 0:
+                raise ValueError('The minv ({}) should be a lower/equal version against maxv ({}).'
+                                 .format(minv, maxv))
+
+        return same_prefix & (cls.compare_many(maxv, metas, ignore_suffix) <= 0) \
+            & (cls.compare_many(minv, metas, ignore_suffix) >= 0)
+
 
 class VersionMeta(object):
     """
@@ -120,114 +302,143 @@ class VersionMeta(object):
     * suffix: version suffix string
 
     Some alternative forms like: 1.0, 1.0.1, 1.0.0.1, com-1, com-1.0 etc.
+
+    Parsed objects are shared through a cache by FlexVersion, so their
+    fields are read-only: derive new versions with add() instead.
     """
 
-    _v_regex = r"(?P<prefix>.*\-)?(?P<major>\d+)(?P<minor>\.\d+)" + \
-               r"(?P<maintenance>\.\d+)?(?P<build>\.\d+)?(?P<suffix_raw>\-.*)?"
-    _suffix_regex = r"(?P<suffix>[^\d]*)(?P<version>\d+)?"
+    __slots__ = ('_raw', '_prefix', '_major', '_minor', '_maintenance', '_build',
+                 '_suffix_raw', '_suffix', '_suffix_version', '_key', '_shape',
+                 '_repr', '_hash')
 
     def __init__(self, version_str):
         self._raw = version_str
-        self.prefix = None
-        self.major = None
-        self.minor = None
-        self.maintenance = None
-        self.build = None
-        self._suffix_raw = None
-        self.suffix = None
-        self.suffix_version = None
-
-        def _trim_field(field, chars=' \r\n-.'):
-            if field is not None:
-                field = field.strip(chars)
-            return field
-
-        matched = re.match(self._v_regex, version_str)
-        if matched:
-            self.prefix = _trim_field(matched.group('prefix'))
-            self.major = int(_trim_field(matched.group('major')))
-
-            _minor = _trim_field(matched.group('minor'))
-            if _minor is not None:
-                self.minor = int(_minor)
-
-            _maintenance = _trim_field(matched.group('maintenance'))
-            if _maintenance is not None:
-                self.maintenance = int(_maintenance)
-
-            _build = _trim_field(matched.group('build'))
-            if _build is not None:
-                self.build = int(_build)
-
-            self._suffix_raw = _trim_field(matched.group('suffix_raw'))
-        else:
-            raise ValueError(
-                'Could not parse the given version: {}'.format(version_str))
-
-        # Support versioned suffix: whose pattern can be specified.
-        if self._suffix_raw:
-            compiled = re.compile(self._suffix_regex)
-            matched = compiled.match(self._suffix_raw)
-            if matched:
-                self.suffix = _trim_field(matched.group('suffix'))
-                suffix_version = matched.group('version')
-                if suffix_version is not None:
-                    self.suffix_version = int(suffix_version)
+        (self._prefix, self._major, self._minor, self._maintenance, self._build,
+         self._suffix_raw, self._suffix, self._suffix_version) = \
+            _match_version(version_str)
+        # Prefixes and suffixes repeat a lot, interned ones compare by identity.
+        if self._prefix:
+            self._prefix = sys.intern(self._prefix)
+        if self._suffix:
+            self._suffix = sys.intern(self._suffix)
+        self._key, self._shape = _numeric_key(
+            self._major, self._minor, self._maintenance, self._build)
+        self._repr = None
+        self._hash = None
+
+    @classmethod
+    def _from_fields(cls, raw, prefix, major, minor, maintenance, build,
+                     suffix_raw, suffix, suffix_version):
+        """
+        Build a VersionMeta from already parsed fields, skipping the parser.
+        """
+        self = object.__new__(cls)
+        self._raw = raw
+        self._prefix = prefix
+        self._major = major
+        self._minor = minor
+        self._maintenance = maintenance
+        self._build = build
+        self._suffix_raw = suffix_raw
+        self._suffix = suffix
+        self._suffix_version = suffix_version
+        self._key, self._shape = _numeric_key(major, minor, maintenance, build)
+        self._repr = None
+        self._hash = None
+        return self
 
     @property
     def raw_str(self):
         return self._raw
 
+    # Read-only field accessors, _key and the memos are derived from them
+    @property
+    def prefix(self):
+        return self._prefix
+
+    @property
+    def major(self):
+        return self._major
+
+    @property
+    def minor(self):
+        return self._minor
+
+    @property
+    def maintenance(self):
+        return self._maintenance
+
+    @property
+    def build(self):
+        return self._build
+
+    @property
+    def suffix(self):
+        return self._suffix
+
+    @property
+    def suffix_version(self):
+        return self._suffix_version
+
     def __repr__(self):
+        if self._repr is not None:
+            return self._repr
+
         args = list()
-        if self.prefix is not None:
-            args.append(self.prefix)
-        if self.major is not None:
-            args.append('-%d' % self.major)
-        if self.minor is not None:
-            args.append('.%d' % self.minor)
-        if self.maintenance is not None:
-            args.append('.%d' % self.maintenance)
-        if self.build is not None:
-            args.append('.%d' % self.build)
-        if self.suffix is not None:
-            args.append('-%s' % self.suffix)
-        if self.suffix_version is not None:
-            args.append('%d' % self.suffix_version)
-        return ''.join(args).strip(' -.')
+        if self._prefix is not None:
+            args.append(self._prefix)
+        if self._major is not None:
+            args.append('-%d' % self._major)
+        if self._minor is not None:
+            args.append('.%d' % self._minor)
+        if self._maintenance is not None:
+            args.append('.%d' % self._maintenance)
+        if self._build is not None:
+            args.append('.%d' % self._build)
+        if self._suffix is not None:
+            args.append('-%s' % self._suffix)
+        if self._suffix_version is not None:
+            args.append('%d' % self._suffix_version)
+        self._repr = ''.join(args).strip(' -.')
+        return self._repr
 
     def __hash__(self):
-        return hash(repr(self))
+        # Only fields every equal pair agrees on: missing maintenance, build
+        # and suffix version act as wildcards in compares().
+        if self._hash is None:
+            self._hash = hash((self._prefix or '', self._major, self._minor,
+                               self._suffix or ''))
+        return self._hash
 
     # Comparisons of VersionMeta objects with other.
 
     def __eq__(self, other):
         if isinstance(other, VersionMeta):
-            return self.compares(other) == 0
+            return self._compare(other) == 0
         else:
             return False
 
     def __le__(self, other):
         if isinstance(other, VersionMeta):
-            return self.compares(other) <= 0
+            return self._compare(other) <= 0
         else:
             _cmperror(self, other)
 
     def __lt__(self, other):
         if isinstance(other, VersionMeta):
-            return self.compares(other) < 0
+            return self._compare(other) < 0
         else:
             _cmperror(self, other)
 
     def __ge__(self, other):
         if isinstance(other, VersionMeta):
-            return self.compares(other) >= 0
+            return self._compare(other) >= 0
         else:
             _cmperror(self, other)
 
     def __gt__(self, other):
         if isinstance(other, VersionMeta):
-            return self.compares(other) > 0
+            return self._compare(other) > 0
         else:
             _cmperror(self, other)
 
@@ -240,56 +451,66 @@ class VersionMeta(object):
             assert res is None or res >= 0
             return res
 
-        cloned = copy.deepcopy(self)
-        cloned.major = _verplus(self.major, delta.major)
-        cloned.minor = _verplus(self.minor, delta.minor)
-        cloned.maintenance = _verplus(self.maintenance, delta.maintenance)
-        cloned.build = _verplus(self.build, delta.build)
-        cloned.suffix_version = _verplus(self.suffix_version, delta.sver)
-
-        if cloned.suffix_version is not None:
-            if suffix is None and cloned.suffix is None:
+        suffix_version = _verplus(self._suffix_version, delta.sver)
+        new_suffix = self._suffix
+        if suffix_version is not None:
+            if suffix is None and self._suffix is None:
                 raise ValueError(
                     "Suffix is required when performing version addition")
             elif suffix is not None:
-                cloned.suffix = suffix
+                new_suffix = suffix
 
-        return cloned
+        return self._from_fields(
+            self._raw, self._prefix,
+            _verplus(self._major, delta.major),
+            _verplus(self._minor, delta.minor),
+            _verplus(self._maintenance, delta.maintenance),
+            _verplus(self._build, delta.build),
+            self._suffix_raw, new_suffix, suffix_version)
 
     def substitute(self, other, ignore_prefix=False, ignore_suffix=False):
         if not isinstance(other, VersionMeta):
             return NotImplemented
 
-        if not ignore_prefix and self.prefix != other.prefix:
+        if not ignore_prefix and self._prefix != other._prefix:
             raise ValueError('VersionMeta substitution requires the same prefix: {} vs. {}'.format(
-                self.prefix, other.prefix))
+                self._prefix, other._prefix))
 
-        if not ignore_suffix and self.suffix != other.suffix:
+        if not ignore_suffix and self._suffix != other._suffix:
             raise ValueError('VersionMeta substitution requires the same suffix: {} vs. {}'.format(
-                self.suffix, other.suffix))
+                self._suffix, other._suffix))
 
-        return VersionDelta(
-            major=_verdiff(self.major, other.major),
-            minor=_verdiff(self.minor, other.minor),
-            maintenance=_verdiff(self.maintenance, other.maintenance),
-            build=_verdiff(self.build, other.build),
-            sver=None if ignore_suffix else _verdiff(
-                self.suffix_version, other.suffix_version)
-        )
+        s1, s2 = self._suffix_version, other._suffix_version
+        diff = [None if n1 is None or n2 is None else n1 - n2
+                for n1, n2 in zip(self._key, other._key)]
+        diff.append(None if ignore_suffix or s1 is None or s2 is None else s1 - s2)
+        return VersionDelta._from_state(tuple(diff))
 
     def shares_prefix(self, other):
         """ Check if two versions share the same prefix
         """
-        if not isinstance(other, VersionMeta):
-            other = VersionMeta(other)
-        return self.prefix == other.prefix
+        other = _as_meta(other)
+        return self._prefix == other._prefix
 
     def shares_suffix(self, other):
         """ Check if two versions share the same suffix
         """
-        if not isinstance(other, VersionMeta):
-            other = VersionMeta(other)
-        return self.suffix == other.suffix
+        other = _as_meta(other)
+        return self._suffix == other._suffix
+
+    def _numeric_cmp(self, other):
+        """
+        Compare the x.y.z.b numbers of two versions, -1, 0 or 1.
+        A field missing on either side does not take part.
+        """
+        k1, k2 = self._key, other._key
+        if self._shape == other._shape:
+            return (k1 > k2) - (k1 < k2)
+
+        for n1, n2 in zip(k1, k2):
+            if n1 is not None and n2 is not None and n1 != n2:
+                return (n1 > n2) - (n1 < n2)
+        return 0
 
     def compares(self, other, ignore_suffix=False):
         """
@@ -298,61 +519,90 @@ class VersionMeta(object):
         """
         if not isinstance(other, VersionMeta):
             return NotImplemented
+        return self._compare(other, ignore_suffix)
 
+    def _compare(self, other, ignore_suffix=False):
+        """
+        compares() for an other already known to be a VersionMeta.
+        """
         # With different prefixes
-        if not self.shares_prefix(other):
-            p1 = '' if self.prefix is None else self.prefix
-            p2 = '' if other.prefix is None else other.prefix
-            prefix_res = 1 if p1 > p2 else -1 if p1 < p2 else 0
+        if self._prefix != other._prefix:
+            p1 = '' if self._prefix is None else self._prefix
+            p2 = '' if other._prefix is None else other._prefix
+            prefix_res = (p1 > p2) - (p1 < p2)
             return prefix_res
 
-        delta = self.substitute(other, ignore_suffix=True)
-
-        if delta > VersionDelta.zero:
-            return 1
-        elif delta < VersionDelta.zero:
-            return -1
+        numeric_res = self._numeric_cmp(other)
+        if numeric_res != 0:
+            return numeric_res
+        if ignore_suffix:
+            return 0
+
+        # Suffix
+        if isinstance(FlexVersion.ordered_suffix, list):
+            # Enable suffix ordering
+            ranks = FlexVersion._suffix_ranks()
+            try:
+                suffix_res = ranks[self._suffix] - ranks[other._suffix]
+            except KeyError as e:
+                raise ValueError('{!r} is not in list'.format(e.args[0]))
+        else:
+            # Notice: none suffix is treated as zero string.
+            s1 = '' if self._suffix is None else self._suffix
+            s2 = '' if other._suffix is None else other._suffix
+            suffix_res = (s1 > s2) - (s1 < s2)
+
+        # Suffix version
+        if suffix_res != 0:
+            return suffix_res
         else:
-            if ignore_suffix:
-                return 0
-
-            # Suffix
-            if isinstance(FlexVersion.ordered_suffix, list):
-                # Enable suffix ordering
-                suffix_res = FlexVersion.ordered_suffix.index(
-                    self.suffix) - FlexVersion.ordered_suffix.index(other.suffix)
-            else:
-                # Notice: none suffix is treated as zero string.
-                s1 = '' if self.suffix is None else self.suffix
-                s2 = '' if other.suffix is None else other.suffix
-                suffix_res = 1 if s1 > s2 else -1 if s1 < s2 else 0
-
-            # Suffix version
-            if suffix_res != 0:
-                return suffix_res
-            else:
-                # Notice: none suffix version diff is treated as zero.
-                sver = _verdiff(self.suffix_version, other.suffix_version)
-                return 0 if sver is None or sver == 0 else 1 if sver > 0 else -1
+            # Notice: none suffix version diff is treated as zero.
+            s1, s2 = self._suffix_version, other._suffix_version
+            return 0 if s1 is None or s2 is None else (s1 > s2) - (s1 < s2)
 
     def in_range(self, minv, maxv, ignore_suffix=False):
         """
         Check if a version exists in a range of (minv, maxv).
         :return True or False
         """
-        if not isinstance(minv, VersionMeta):
-            minv = VersionMeta(minv)
-        if not isinstance(maxv, VersionMeta):
-            maxv = VersionMeta(maxv)
+        minv = _as_meta(minv)
+        maxv = _as_meta(maxv)
+
+        if not self._prefix == minv._prefix == maxv._prefix:
+            return False
 
-        if not (self.shares_prefix(minv) and self.shares_prefix(maxv)):
+        # Sanity check of the arguments, skipped under python -O.
+        if __debug__:
+            if minv._compare(maxv, ignore_suffix) > 0:
+                raise ValueError('The minv ({}) should be a lower/equal version against maxv ({}).'
+                                 .format(minv, maxv))
+
+        if self._shape == minv._shape == maxv._shape:
+            # Plain tuple bounds, only a tie on a bound leaves it to the suffix.
+            key, min_key, max_key = self._key, minv._key, maxv._key
+            if key < min_key or key > max_key:
+                return False
+            if ignore_suffix or min_key < key < max_key:
+                return True
+
+        if self._compare(maxv, ignore_suffix) > 0:
             return False
+        return self._compare(minv, ignore_suffix) >= 0
+
+    # Pickle support.
 
-        if minv.compares(maxv, ignore_suffix) > 0:
-            raise ValueError('The minv ({}) should be a lower/equal version against maxv ({}).'
-                             .format(minv, maxv))
+    def _getstate(self):
+        return (self._raw, self._prefix, self._major, self._minor, self._maintenance,
+                self._build, self._suffix_raw, self._suffix, self._suffix_version)
 
-        return self.compares(maxv, ignore_suffix) <= 0 <= self.compares(minv, ignore_suffix)
+    def __reduce__(self):
+        # Only the parsed fields: the memoized hash is only valid within
+        # one process, and _key/_shape are rebuilt by _from_fields.
+        return self._from_fields, self._getstate()
+
+
+# None-as-zero state of a VersionDelta with no difference.
+_ZERO_STATE = (0, 0, 0, 0, 0)
 
 
 class VersionDelta(object):
@@ -371,19 +621,31 @@ class VersionDelta(object):
     returning a VersionDelta, and addition or subtraction of a VersionMeta
     and a VersionDelta giving a VersionMeta.
     """
-    __slots__ = '_major', '_minor', '_maintenance', '_build', '_sver', '_hashcode'
+    __slots__ = ('_major', '_minor', '_maintenance', '_build', '_sver',
+                 '_state', '_state0', '_hashcode', '_repr')
 
     def __new__(cls, major=None, minor=None, maintenance=None, build=None, sver=None):
+        return cls._from_state((major, minor, maintenance, build, sver))
+
+    @classmethod
+    def _from_state(cls, state):
+        """
+        Build a delta straight from a (major, minor, maintenance, build, sver)
+        tuple, the arithmetic operators use it to skip argument binding.
+        """
         self = object.__new__(cls)
-        self._major = major
-        self._minor = minor
-        self._maintenance = maintenance
-        self._build = build
-        self._sver = sver
-        self._hashcode = -1
+        self._major, self._minor, self._maintenance, self._build, self._sver = state
+        self._state = state
+        self._state0 = tuple([0 if v is None else v for v in state])
+        # Hash what the comparisons use, so VersionDelta(0) and VersionDelta() agree.
+        self._hashcode = hash(self._state0)
+        self._repr = None
         return self
 
     def __repr__(self):
+        if self._repr is not None:
+            return self._repr
+
         args = []
         if self._major is not None:
             args.append("major=%d" % self._major)
@@ -397,9 +659,10 @@ class VersionDelta(object):
             args.append("sver=%d" % self._sver)
         if not args:
             args.append('0')
-        return "%s.%s(%s)" % (self.__class__.__module__,
-                              self.__class__.__name__,
-                              ', '.join(args))
+        self._repr = "%s.%s(%s)" % (self.__class__.__module__,
+                                    self.__class__.__name__,
+                                    ', '.join(args))
+        return self._repr
 
     # Read-only field accessors
     @property
@@ -424,13 +687,9 @@ class VersionDelta(object):
 
     def __add__(self, other):
         if isinstance(other, VersionDelta):
-            return VersionDelta(
-                _veradd(self._major, other._major),
-                _veradd(self._minor, other._minor),
-                _veradd(self._maintenance, other._maintenance),
-                _veradd(self._build, other._build),
-                _veradd(self._sver, other._sver)
-            )
+            return VersionDelta._from_state(tuple([
+                None if x is None or y is None else x + y
+                for x, y in zip(self._state, other._state)]))
         return NotImplemented
 
     __radd__ = __add__
@@ -441,37 +700,22 @@ class VersionDelta(object):
         return NotImplemented
 
     def __neg__(self):
-        return VersionDelta(
-            _verrev(self._major),
-            _verrev(self._minor),
-            _verrev(self._maintenance),
-            _verrev(self._build),
-            _verrev(self._sver)
-        )
+        return VersionDelta._from_state(tuple([None if x is None else -x
+                                               for x in self._state]))
 
     def __pos__(self):
         return self
 
     def __abs__(self):
-        return VersionDelta(
-            _verabs(self._major),
-            _verabs(self._minor),
-            _verabs(self._maintenance),
-            _verabs(self._build),
-            _verabs(self._sver)
-        )
+        return VersionDelta._from_state(tuple([None if x is None else abs(x)
+                                               for x in self._state]))
 
     def __mul__(self, other):
         if isinstance(other, int):
             # for CPython compatibility, we cannot use
             # our __class__ here, but need a real VersionDelta
-            return VersionDelta(
-                _vermul(self._major, other),
-                _vermul(self._minor, other),
-                _vermul(self._maintenance, other),
-                _vermul(self._build, other),
-                _vermul(self._sver, other)
-            )
+            return VersionDelta._from_state(tuple([None if x is None else x * other
+                                                   for x in self._state]))
         return NotImplemented
 
     __rmul__ = __mul__
@@ -480,57 +724,48 @@ class VersionDelta(object):
 
     def __eq__(self, other):
         if isinstance(other, VersionDelta):
-            return self._cmp(other) == 0
+            return self._state0 == other._state0
         else:
             return False
 
     def __le__(self, other):
         if isinstance(other, VersionDelta):
-            return self._cmp(other) <= 0
+            return self._state0 <= other._state0
         else:
             _cmperror(self, other)
 
     def __lt__(self, other):
         if isinstance(other, VersionDelta):
-            return self._cmp(other) < 0
+            return self._state0 < other._state0
         else:
             _cmperror(self, other)
 
     def __ge__(self, other):
         if isinstance(other, VersionDelta):
-            return self._cmp(other) >= 0
+            return self._state0 >= other._state0
         else:
             _cmperror(self, other)
 
     def __gt__(self, other):
         if isinstance(other, VersionDelta):
-            return self._cmp(other) > 0
+            return self._state0 > other._state0
         else:
             _cmperror(self, other)
 
-    def _cmp(self, other):
-        assert isinstance(other, VersionDelta)
-        return _cmp(self._getstate(none_as=0), other._getstate(none_as=0))
-
     def __hash__(self):
-        if self._hashcode == -1:
-            self._hashcode = hash(self._getstate())
         return self._hashcode
 
     def __bool__(self):
-        return (
-                not self._major or
-                not self._minor or
-                not self._maintenance or
-                not self._build or
-                not self._sver
-        )
+        return self._state0 != _ZERO_STATE
 
     # Pickle support.
 
     def _getstate(self, none_as=None):
-        s = (self._major, self._minor, self._maintenance, self._build, self._sver)
-        return tuple([none_as if i is None else i for i in s])
+        if none_as is None:
+            return self._state
+        elif none_as == 0:
+            return self._state0
+        return tuple([none_as if i is None else i for i in self._state])
 
     def __reduce__(self):
         return self.__class__, self._getstate()
@@ -555,6 +790,7 @@ VersionDelta.max = VersionDelta(
 VersionDelta.zero = VersionDelta(0, 0, 0, 0, 0)
 
 if __name__ == '__main__':
+    import pickle
     from functools import cmp_to_key
 
     # VersionMeta parsers
@@ -599,6 +835,40 @@ if __name__ == '__main__':
     assert vm.suffix is None
     assert vm.suffix_version is None
 
+    # Equal versions hash alike, so they deduplicate in sets
+    assert len({VersionMeta('1.0'), VersionMeta('1.0.0'), VersionMeta('1.0-1')}) == 1
+
+    # Pickling keeps the fields and drops the memoized hash
+    v = VersionMeta('prev-1.0.2-rc1')
+    hash(v), repr(v)
+    for proto in range(pickle.HIGHEST_PROTOCOL + 1):
+        u = pickle.loads(pickle.dumps(v, proto))
+        assert u._hash is None and u._repr is None
+        assert u == v and u in {VersionMeta('prev-1.0.2-rc1')}
+        assert u._getstate() == v._getstate() and u._key == v._key
+    u = pickle.loads(pickle.dumps(v.add(VersionDelta(minor=1))))
+    assert str(u) == 'prev-1.1.2-rc1' and u.raw_str == 'prev-1.0.2-rc1'
+
+    # The whole string has to match, surrounding whitespace aside
+    assert VersionMeta('1.0\n') == VersionMeta('1.0')
+    assert VersionMeta('spark-sql-2.0-rc1').prefix == 'spark-sql'
+    assert VersionMeta('1.0-rc\u0663').suffix == 'rc\u0663'
+    for v in ['1.0rc1', '1.0.0.0.0', 'prev-1']:
+        try:
+            VersionMeta(v)
+            assert False, v
+        except ValueError:
+            pass
+    for v in [None, 1, b'1.0']:
+        try:
+            VersionMeta(v)
+            assert False, v
+        except TypeError:
+            pass
+
+    # Long inputs do not make the regex backtrack quadratically
+    assert VersionMeta('1.0-' * 20000 + '\nx').major == 1
+
     # VersionMeta addition
     v = VersionMeta('prev-1.0.0-rc0')
     d = VersionDelta(sver=1)
@@ -616,6 +886,20 @@ if __name__ == '__main__':
     d = VersionDelta(maintenance=0, sver=1)
     assert str(v.add(d, suffix='rc')) == 'prev-1.0.0-rc1'
 
+    # VersionDelta truth value
+    assert not VersionDelta.zero
+    assert not VersionDelta()
+    assert VersionDelta(build=1)
+    assert VersionDelta(major=-1, minor=0)
+    assert len({VersionDelta(), VersionDelta(major=0), VersionDelta.zero}) == 1
+
+    # VersionDelta arithmetic
+    d = VersionDelta(major=1, minor=-2, build=3)
+    assert -d == VersionDelta(major=-1, minor=2, build=-3)
+    assert abs(d) == VersionDelta(major=1, minor=2, build=3)
+    assert d * 2 == VersionDelta(major=2, minor=-4, build=6)
+    assert d + d == 2 * d
+
     # VersionMeta substitution and comparison
 
     v1 = VersionMeta('prev-1.0.0-rc0')
@@ -642,11 +926,27 @@ if __name__ == '__main__':
     # FlexVersion comparisons
     fv = FlexVersion
 
+    # Parsed strings are cached and shared, so their fields are read-only
+    assert fv.parse_version('prev-1.0') is fv.parse_version('prev-1.0')
+    try:
+        fv.parse('2.0').major = 9
+        assert False
+    except AttributeError:
+        pass
+    assert fv.parse('2.0').major == 2
+
     try:
         fv.compares('prev-1.0', 'other-1.0')
     except ValueError as e:
         pass
 
+    for v in [None, 1]:
+        try:
+            fv.compares(v, '1.0')
+            assert False, v
+        except TypeError:
+            pass
+
     assert fv.compares('prev-1.0', 'prev-1.0') == 0
     assert fv.compares('prev-1.0', 'prev-2.0') < 0
     assert fv.compares('prev-2.0', 'prev-1.0') > 0
@@ -676,6 +976,31 @@ if __name__ == '__main__':
     assert str(vers_sorted[0]) == '1.0'
     assert str(vers_sorted[-1]) == '1.2'
 
+    # FlexVersion batch comparisons
+    if np is not None:
+        candidates = ['prev-0.9', 'prev-1.0.0-rc1', 'prev-1.0.1', 'prev-1.1', 'other-1.0']
+        assert list(fv.compare_many('prev-1.0', candidates)) == [-1, 1, 0, 1, -1]
+        assert list(fv.compare_many('prev-1.0.0-rc2', candidates)) == [-1, -1, 1, 1, -1]
+        assert list(fv.compare_many('prev-1.0.0-rc2', candidates, True)) == [-1, 0, 1, 1, -1]
+        assert len(fv.compare_many('prev-1.0', [])) == 0
+        assert list(fv.in_range_many(candidates, 'prev-1.0', 'prev-1.0.1')) == \
+            [False, True, True, False, False]
+        assert list(fv.in_range_many(candidates, 'prev-1.0', 'prev-1.0.1', True)) == \
+            [False, True, True, False, False]
+        assert list(fv.in_range_many(candidates, 'prev-1.0.0', 'prev-1.0.0-rc5')) == \
+            [False, True, False, False, False]
+        assert not fv.in_range_many(candidates, 'none-1.0', 'none-2.0').any()
+
+        # Numbers beyond int64 fall back to the scalar comparison
+        huge = 'prev-1.' + '9' * 20
+        assert list(fv.compare_many('prev-1.0', [huge, 'prev-1.0'])) == [1, 0]
+        assert list(fv.compare_many(huge, candidates)) == \
+            [fv.compares(c, huge) for c in candidates]
+        assert list(fv.in_range_many(['1.0', '1.5', '2.0'], '1.0', '1.' + '9' * 20)) == \
+            [True, True, False]
+        assert list(fv.in_range_many(candidates + [huge], 'prev-1.0.1', huge)) == \
+            [fv.in_range(c, 'prev-1.0.1', huge) for c in candidates + [huge]]
+
     # FlexVersion comparisons with ordered suffix
     fv.ordered_suffix = [None, 'alpha', 'beta', 'rc', 'final']
     assert fv.compares('prev-1.0.0-beta', 'prev-1.0.0-alpha') > 0
@@ -716,3 +1041,25 @@ if __name__ == '__main__':
     assert not fv.in_range('prev-1.1', 'prev-1.1.0-rc0', 'prev-1.1.0-final')
     assert fv.in_range('prev-1.1', 'prev-1.1.0-rc0', 'prev-1.1.0-final', True)
     fv.ordered_suffix = None
+
+    # Editing ordered_suffix in place takes effect
+    fv.ordered_suffix = ['a', 'b']
+    assert fv.compares('1.0-a', '1.0-b') < 0
+    fv.ordered_suffix.insert(0, 'b')
+    assert fv.compares('1.0-a', '1.0-b') > 0
+    fv.ordered_suffix = None
+
+    # A range checker agrees with in_range
+    check = fv.range_checker('prev-1.0.0-rc5', 'prev-1.0.2-rc5')
+    for v in ['prev-1.0.1-rc5', 'prev-1.0.3-rc5', 'prev-1.0.0-rc4', 'prev-1.0', 'other-1.0.1']:
+        assert check(v) == fv.in_range(v, 'prev-1.0.0-rc5', 'prev-1.0.2-rc5')
+
+    # Misordered bounds raise only where in_range would, i.e. on a shared prefix
+    check = fv.range_checker('prev-2.0', 'prev-1.0')
+    assert not check('other-1.5') and not fv.in_range('other-1.5', 'prev-2.0', 'prev-1.0')
+    if __debug__:
+        try:
+            check('prev-1.5')
+            assert False
+        except ValueError:
+            pass
@@ -9,6 +9,10 @@ setup(
     description='A cute Python library to manipulate version stuff.',
     license="Apache License, Version 2.0",
     packages=['flex_version'],
+    python_requires='>=3.4',
+    extras_require={
+        'numpy': ['numpy'],
+    },
     keywords=['utility', 'versioning'],
     classifiers=[
         'Development Status :: 4 - Beta',
@@ -16,11 +20,7 @@ setup(
         'Intended Audience :: Developers',
         'Operating System :: OS Independent',
         'Programming Language :: Python',
-        'Programming Language :: Python :: 2',
-        'Programming Language :: Python :: 2.6',
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.3',
         'Programming Language :: Python :: 3.4',
         'Programming Language :: Python :: 3.5',
         'Programming Language :: Python :: 3.6',